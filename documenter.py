@@ -11,19 +11,26 @@ Usage:
 Requirements:
     - GEMINI_API_KEY environment variable must be set
     - pip install google-genai
+    - pip install aiolimiter tenacity diskcache orjson
+    - FEA_RPM sets the client-side requests-per-minute limit (default 60)
 """
-import json
+import asyncio
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 import argparse
 
-from transformers import pipeline, set_seed
-
-from utils.prompt_builder import build_prompt
-from utils.load_instances import load_successful_instances, load_oracle_tasks
-from utils.generate_patch import generate_doc, save_doc
+from utils.system_prompts import DOCUMENTER_SYSTEM
+from utils.prompt_builder import build_prompt_parts
+from utils.load_instances import load_completed_instances, load_successful_instances, load_oracle_tasks
+from utils.generate_patch import agenerate_doc, save_doc
+from utils.context_cache import ContextCaches
+from utils import response_cache
+from utils.dispatch import MAX_INFLIGHT, run_windowed, write_results
 
 # ----- Configuration -----
 ROOT = Path("/storage/ice1/shared/ece8803cai/team14/FEA-Bench")
@@ -37,23 +44,25 @@ GEMINI_MODEL = "gemini-2.5-flash"
 # DeepSeek Config
 DEEPSEEK_MODEL = "deepseek-chat"
 
-SYSTEM_INSTRUCTION = """You are an expert software engineer tasked with creating documents that other software engineers can use to implement new features.
-
-Given a problem description and repository context, generate a detailed, specific document explaining how to implement the requested feature. Think about what features would be useful for you to have if you were going to code the feature. 
+SYSTEM_INSTRUCTION = DOCUMENTER_SYSTEM
 
-Your document should:
-1. Be as specific possible without any ambiguity. Another software engineer should be able to clearly follow the steps outlined in your document to implement the feature
-2. Synthesize a large amount of context while retaining as much valuable information as possible
-3. Make clear to another engineer how to follow the coding style of the existing codebase
-4. You may provide a repository overview, a clear implementation plan, pseudo-code in relevant files, or any other information that you believe would be helpful """
 
+logger = logging.getLogger(__name__)
 
 MAX_INSTANCES = None  # Set to a number like 5 for testing, or None for all
+CONCURRENCY = 16  # Max API requests in flight at once (override with --concurrency)
 
-def main():
+async def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--model", choices=['gemini', 'deepseek'], help="Define the documenter model.")
+    ap.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Max concurrent API requests.")
+    ap.add_argument("--max-inflight", type=int, default=MAX_INFLIGHT, help="Max task coroutines alive at once (env FEA_MAX_INFLIGHT).")
+    ap.add_argument("--force", action="store_true", help="Re-run instances already completed in the results file.")
+    ap.add_argument("--dump-prompts", action="store_true", help="Write each prompt to documenter_prompts/<repo>__<instance_id>.txt.")
+    ap.add_argument("--no-cache", action="store_true", help="Always call the model instead of reusing cached responses.")
+    ap.add_argument("--no-context-cache", action="store_true", help="Disable Gemini context caching of the shared prompt prefix.")
     args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     """Main execution function."""
     print("="*60)
@@ -90,15 +99,29 @@ def main():
     
     # Create output directories
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    if args.dump_prompts:
+        Path("documenter_prompts").mkdir(exist_ok=True)
     RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
     
     # Load tasks with filter
-    tasks = load_oracle_tasks(ORACLE_ROOT, successful_filter)
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as ex:
+        tasks = load_oracle_tasks(ORACLE_ROOT, successful_filter, executor=ex)
     
     if not tasks:
         print("[ERROR] No tasks loaded. Exiting.")
         return
     
+    # Keep each repo's instances adjacent so repo context and prefix caches hit
+    tasks.sort(key=lambda t: (t["repo"], t["base_commit"]))
+    
+    # Resume: skip instances a previous run already completed
+    if not args.force:
+        done = load_completed_instances(RESULTS_FILE, "doc_generated")
+        if done:
+            remaining = [t for t in tasks if t["instance_id"] not in done]
+            print(f"[INFO] Skipping {len(tasks) - len(remaining)} instances already completed in {RESULTS_FILE}")
+            tasks = remaining
+    
     # Limit tasks if specified
     if MAX_INSTANCES is not None:
         tasks = tasks[:MAX_INSTANCES]
@@ -108,55 +131,76 @@ def main():
     print("="*60)
     print("Beginning Task Processing")
     print("="*60)
-    results = []
-    for i, task in enumerate(tasks, 1):
+    # Cache the system instruction + repo documentation once per repo (Gemini only);
+    # each repo's cache is created when its first task comes up
+    context_caches = None
+    if args.model == "gemini" and not args.no_context_cache:
+        context_caches = ContextCaches(model, SYSTEM_INSTRUCTION)
+
+    sem = asyncio.Semaphore(args.concurrency)
+    queue = asyncio.Queue()
+    writer = asyncio.create_task(write_results(queue, RESULTS_FILE))
+
+    async def process_task(i, task):
+        # Bookkeeping lives here, not in the dispatcher, so it overlaps with network waits
+        t0 = time.monotonic()
         instance_id = task["instance_id"]
         repo = task["repo"]
-        base_commit = task["base_commit"]
-        
-        print(f"\n[{i}/{len(tasks)}] Processing {instance_id}")
-        print(f"  Repo: {repo}")
-        print(f"  Base Commit: {base_commit}")
-        
-        result = {
-            "instance_id": instance_id,
-            "repo": repo,
-            "base_commit": base_commit,
-            "timestamp": datetime.now().isoformat(),
-            "model": model,
-            "doc_generated": False,
-            "doc_path": None,
-            "error": None,
-        }
+        repo_slug = repo.replace("/", "__")
+        doc_path = None
+        error = None
         
         try:
             # Build prompt
-            prompt = build_prompt(task, "documenter")
-            repo_slug = repo.replace("/", "__")
-            with open(f"documenter_prompts/{repo_slug}.txt", "w") as f:
-                f.write(prompt)
+            prefix, suffix = build_prompt_parts(task, "documenter")
+            prompt = prefix + suffix
+            # A prompt already answered in the on-disk response cache never reaches the
+            # API, so it must not trigger a (billable) context cache for its repo
+            cache_name = None
+            if context_caches and (args.no_cache or response_cache.get(response_cache.make_key(model, SYSTEM_INSTRUCTION, prompt)) is None):
+                cache_name = await context_caches.get(prefix)
+            if args.dump_prompts:
+                Path(f"documenter_prompts/{repo_slug}__{instance_id}.txt").write_text(prompt)
             
             # Generate docoument
-            doc_text = generate_doc(prompt, instance_id, args.model, model, SYSTEM_INSTRUCTION)
+            async with sem:
+                doc_text = await agenerate_doc(prompt, instance_id, args.model, model, SYSTEM_INSTRUCTION, (cache_name, prefix) if cache_name else None, use_cache=not args.no_cache)
             
             if doc_text:
                 # Save document
                 doc_path = save_doc(doc_text, task, OUTPUT_DIR)
-                result["doc_generated"] = True
-                result["doc_path"] = doc_path
-                print(f"  [SUCCESS] Document generated for {instance_id}")
             else:
-                result["error"] = "Failed to generate document"
-                print(f"  [FAILED] Could not generate document for {instance_id}")
+                error = "Failed to generate document"
         
         except Exception as e:
-            result["error"] = str(e)
-            print(f"  [ERROR] Exception for {instance_id}: {e}")
+            error = str(e)
+        
+        elapsed = time.monotonic() - t0
+        status = "SUCCESS" if doc_path else "FAILED"
+        logger.info("[%d/%d] %s %s (%s, %.1fs)%s", i, len(tasks), status, instance_id, repo, elapsed, f": {error}" if error else "")
+        result = {
+            "instance_id": instance_id,
+            "repo": repo,
+            "base_commit": task["base_commit"],
+            "timestamp": datetime.now().isoformat(),
+            "model": model,
+            "doc_generated": doc_path is not None,
+            "doc_path": doc_path,
+            "error": error,
+            "elapsed_s": round(elapsed, 3),
+        }
         
-        # Save result incrementally
-        results.append(result)
-        with open(RESULTS_FILE, "a") as f:
-            f.write(json.dumps(result) + "\n")
+        # Hand result to the single writer so JSONL lines never interleave
+        await queue.put(result)
+        return result
+
+    try:
+        results = await run_windowed(process_task, enumerate(tasks, 1), args.max_inflight)
+    finally:
+        await queue.put(None)
+        await writer
+        if context_caches:
+            await context_caches.close()
     
     # Print summary
     print("\n" + "="*60)
@@ -176,5 +220,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
 
@@ -1,35 +1,114 @@
 import json
 import csv
+import hashlib
 import os
+import re
+import shlex
+import shutil
 import subprocess
+import tempfile
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import Manager
 from pathlib import Path
 
+import orjson
+
+from utils.load_instances import iter_jsonl
+
 # ----- Paths -----
 ROOT = Path("/storage/ice1/shared/ece8803cai/team14/FEA-Bench")
 ORACLE_ROOT = ROOT / "feabench-data" / "repo_data_oracle_lite"
 REPO_ROOT = ROOT / "repos_all"         
 RESULTS_PATH = ROOT / "oracle_results.jsonl"
+VENV_CACHE = REPO_ROOT / ".venv_cache"   # venvs keyed by repo + dependency-file hash
+PIP_CACHE = ROOT / ".pip_cache"          # wheel/http cache shared by every install
+WHEEL_CACHE = ROOT / ".wheel_cache"      # dependency wheels built up front by prewarm_wheels
+LOG_ROOT = ROOT / "logs"                 # per-task command output, one file per phase
+WORKTREE_ROOT = REPO_ROOT / ".worktrees"  # per-repo test_patch / fix_patch worktrees
 
 REPO_ROOT.mkdir(exist_ok=True, parents=True)
+PIP_CACHE.mkdir(exist_ok=True, parents=True)
+WHEEL_CACHE.mkdir(exist_ok=True, parents=True)
+
+# ----- Installer -----
+UV = shutil.which("uv")  # None -> use pip inside the venv
+INSTALL_ENV = {
+    **os.environ,
+    "PIP_CACHE_DIR": str(PIP_CACHE),
+    "UV_CACHE_DIR": str(PIP_CACHE / "uv"),
+    "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+    "PIP_NO_INPUT": "1",
+    # wheels pre-built by prewarm_wheels are picked up before the index
+    "PIP_FIND_LINKS": str(WHEEL_CACHE),
+    "UV_FIND_LINKS": str(WHEEL_CACHE),
+}
+# For local object probes in the partial clones: without it, asking about a
+# missing commit makes git lazily fetch it from the promisor remote with its
+# full history (honored by git >= 2.44, and 2.39.4+ security releases)
+NO_LAZY_FETCH_ENV = {**os.environ, "GIT_NO_LAZY_FETCH": "1"}
+
+MAX_REPOS = 300  # Stop after processing this many repos
+MAX_WORKERS = 4  # Parallel repo workers; kept low to avoid GitHub clone rate limits
+PREWARM_WHEELS = True  # Build dependency wheels for all repos before running tasks
+OUTPUT_SPOOL_BYTES = 16 * 1024 * 1024  # Command output kept in memory up to this size
+FAILURE_TAIL_LINES = 50  # Lines of output printed when a command fails
+DEBUG_TESTS = False  # Run pytest with -vs (verbose, no capture) for debugging
+
+_XDIST_AVAILABLE = {}  # resolved venv dir -> pytest-xdist importable
+
+# "b/<path>" side of a "diff --git" header, for test .py files
+_TEST_FILE_RE = re.compile(r" b/(.*test.*\.py)$", re.IGNORECASE)
+
+def run_cmd(cmd, cwd, env=None, log_path=None):
+    """
+    Run a command given as an argv list (no shell), return (ok, output).
 
-def run_cmd(cmd, cwd, env=None):
-    """Run a shell command, return (ok, output)."""
-    print(f">> [RUN] {cmd} (cwd={cwd})")
-    res = subprocess.run(
-        cmd,
-        cwd=str(cwd),
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        env=env,
+    Full output is appended to log_path (when given) instead of being
+    printed; only the last FAILURE_TAIL_LINES lines are printed on failure.
+    """
+    header = f">> [RUN] {shlex.join(cmd)} (cwd={cwd})"
+    print(header)
+    # Output goes to a temp file rather than a PIPE: no pipe-buffer stalls or
+    # small reads on huge pytest logs (handing the fileno to the child rolls
+    # the spooled file over to disk)
+    with tempfile.SpooledTemporaryFile(max_size=OUTPUT_SPOOL_BYTES, mode="w+b") as out_f:
+        res = subprocess.run(
+            cmd,
+            cwd=str(cwd),
+            shell=False,
+            stdout=out_f,
+            stderr=subprocess.STDOUT,
+            bufsize=-1,
+            env=env,
+        )
+        out_f.seek(0)
+        output = out_f.read().decode(errors="replace")
+
+    if log_path is not None:
+        with open(log_path, "a") as log_f:
+            log_f.write(f"{header}\n{output}\n")
+
+    ok = res.returncode == 0
+    if not ok:
+        tail = output.splitlines()[-FAILURE_TAIL_LINES:]
+        where = f"; full log: {log_path}" if log_path is not None else ""
+        print(f"[WARN] Command exited with {res.returncode}{where}")
+        if tail:
+            print("\n".join(tail))
+    return ok, output
+
+def fetch_commit(repo_dir, commit, log_path=None):
+    """Fetch a single commit by SHA (depth 1, no blobs until checkout, no other refs)."""
+    ok, _ = run_cmd(
+        ["git", "-c", "protocol.version=2", "fetch", "--depth=1", "--filter=blob:none", "origin", commit],
+        cwd=repo_dir, log_path=log_path,
     )
-    print(res.stdout)
-    return res.returncode == 0, res.stdout
+    return ok
 
-def ensure_repo_cloned(repo_slug):
+def ensure_repo_cloned(repo_slug, base_commit, log_path=None):
     """
-    Given 'owner/name', clone into repos_all/owner__name if not already there.
+    Given 'owner/name', set up repos_all/owner__name with base_commit if not already there.
     Return path to local repo dir.
     """
     owner, name = repo_slug.split("/")
@@ -38,59 +117,157 @@ def ensure_repo_cloned(repo_slug):
 
     if not repo_dir.exists():
         url = f"https://github.com/{repo_slug}.git"
-        print(f"Cloning {repo_slug} into {repo_dir} ...")
-        ok, _ = run_cmd(f"git clone {url} {repo_dir}", cwd=ROOT)
+        print(f"Fetching {repo_slug} @ {base_commit} into {repo_dir} ...")
+        # Only the base commit is needed: init + fetch it by SHA instead of
+        # cloning history, branches and tags. Other bases are fetched on demand
+        # by reset_to_base.
+        ok, _ = run_cmd(["git", "init", "-q", str(repo_dir)], cwd=ROOT, log_path=log_path)
+        if ok:
+            ok, _ = run_cmd(["git", "remote", "add", "origin", url], cwd=repo_dir, log_path=log_path)
+        if ok:
+            ok = fetch_commit(repo_dir, base_commit, log_path=log_path)
+        if ok:
+            ok, _ = run_cmd(["git", "checkout", "-q", "--detach", "FETCH_HEAD"], cwd=repo_dir, log_path=log_path)
         if not ok:
             print(f"[ERROR] Failed to clone {repo_slug}")
+            # don't leave a half-initialized repo behind for the next task / run
+            shutil.rmtree(repo_dir, ignore_errors=True)
             return None
     else:
         print(f"Repo {repo_slug} already cloned at {repo_dir}")
 
+    # keep the .venv link out of `git status` / `git clean` in the repo and its worktrees
+    exclude_file = repo_dir / ".git" / "info" / "exclude"
+    existing = exclude_file.read_text() if exclude_file.exists() else ""
+    if ".venv" not in existing.splitlines():
+        exclude_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(exclude_file, "a") as f:
+            f.write(("" if existing.endswith("\n") or not existing else "\n") + ".venv\n")
+
     return repo_dir
 
-def reset_to_base(repo_dir, base_commit):
-    """Hard reset repo to base commit and wipe untracked files."""
-    ok, _ = run_cmd(f"git reset --hard {base_commit}", cwd=repo_dir)
+def reset_to_base(repo_dir, base_commit, log_path=None):
+    """Hard reset repo to base commit and wipe untracked files (except the .venv link)."""
+    # Repo may have been set up for another base: fetch just this commit
+    has_commit, _ = run_cmd(
+        ["git", "cat-file", "-e", f"{base_commit}^{{commit}}"],
+        cwd=repo_dir, env=NO_LAZY_FETCH_ENV, log_path=log_path,
+    )
+    if not has_commit:
+        if not fetch_commit(repo_dir, base_commit, log_path=log_path):
+            print(f"[ERROR] Failed to fetch {base_commit}")
+            return False
+
+    ok, _ = run_cmd(["git", "reset", "--hard", base_commit], cwd=repo_dir, log_path=log_path)
     if not ok:
         return False
-    ok, _ = run_cmd("git clean -xdf", cwd=repo_dir)
+    ok, _ = run_cmd(["git", "clean", "-xdf", "-e", ".venv"], cwd=repo_dir, log_path=log_path)
     return ok
 
-def create_venv_and_install(repo_dir):
-    """Create .venv, install repo and pytest deps."""
-    venv_dir = repo_dir / ".venv"
-    # fresh venv every time for robustness
-    if venv_dir.exists():
-        ok, _ = run_cmd("rm -rf .venv", cwd=repo_dir)
-        if not ok:
-            return False
+def venv_python(repo_dir):
+    """Path of the python binary inside repo_dir/.venv (used directly instead of activating)."""
+    return repo_dir / ".venv" / "bin" / "python"
+
+def venv_fingerprint(repo_dir):
+    """Hash the dependency files of the checked-out tree (setup.py, pyproject.toml, requirements*.txt)."""
+    h = hashlib.sha256()
+    dep_files = [repo_dir / "setup.py", repo_dir / "setup.cfg", repo_dir / "pyproject.toml"]
+    dep_files += sorted(repo_dir.glob("requirements*.txt"))
+    for path in dep_files:
+        if path.is_file():
+            h.update(path.name.encode())
+            h.update(path.read_bytes())
+    return h.hexdigest()[:16]
+
+def unlink_venv(venv_link):
+    """Remove repo_dir/.venv, whether it is a link into VENV_CACHE or a real directory."""
+    if venv_link.is_symlink():
+        venv_link.unlink()
+    elif venv_link.exists():
+        shutil.rmtree(venv_link)
+
+def create_venv_and_install(repo_dir, log_path=None, cache_name=None):
+    """
+    Point repo_dir/.venv at a cached venv for the current dependency files.
 
-    ok, _ = run_cmd("python3 -m venv .venv", cwd=repo_dir)
+    Venvs live under VENV_CACHE/<cache_name or repo>/<fingerprint> and are
+    built once; when the fingerprint is unchanged (the common case across tasks
+    of a repo) only the editable install of the current tree is refreshed.
+    """
+    venv_link = repo_dir / ".venv"
+    cached_venv = VENV_CACHE / (cache_name or repo_dir.name) / venv_fingerprint(repo_dir)
+    ready_marker = cached_venv / ".install_complete"
+    python = str(venv_python(repo_dir))
+    # uv is a drop-in, much faster installer; fall back to the venv's pip without it
+    pip = [UV, "pip", "--python", python] if UV else [python, "-m", "pip"]
+
+    if ready_marker.exists():
+        # .venv survives `git clean`, so it usually already points at the right venv
+        if not (venv_link.is_symlink() and venv_link.resolve() == cached_venv.resolve()):
+            print(f"[INFO] Reusing cached venv {cached_venv}")
+            unlink_venv(venv_link)
+            venv_link.symlink_to(cached_venv)
+        # refresh the editable install: clean -x also wipes in-place extension builds
+        ok, _ = run_cmd(pip + ["install", "-e", ".", "--no-deps"], cwd=repo_dir, env=INSTALL_ENV, log_path=log_path)
+        return ok
+
+    # build a fresh venv in the cache (discarding any half-built one)
+    unlink_venv(venv_link)
+    if cached_venv.exists():
+        shutil.rmtree(cached_venv)
+    cached_venv.parent.mkdir(parents=True, exist_ok=True)
+
+    if UV:
+        # --seed keeps pip/setuptools/wheel in the venv for repos that shell out to them
+        venv_cmd = [UV, "venv", "--seed", "--python", "python3", str(cached_venv)]
+    else:
+        venv_cmd = ["python3", "-m", "venv", str(cached_venv)]
+    ok, _ = run_cmd(venv_cmd, cwd=repo_dir, env=INSTALL_ENV, log_path=log_path)
     if not ok:
         return False
+    venv_link.symlink_to(cached_venv)
 
-    # activate venv and install
-    activate = "source .venv/bin/activate"
     cmds = [
-        f"{activate} && python -m pip install -U pip wheel setuptools",
-        f"{activate} && pip install -e .",
-        f"{activate} && pip install 'pytest<9' wcag-contrast-ratio || true",
+        pip + ["install", "-U", "pip", "wheel", "setuptools"],
+        pip + ["install", "-e", "."],
     ]
     for cmd in cmds:
-        ok, _ = run_cmd(cmd, cwd=repo_dir)
+        ok, _ = run_cmd(cmd, cwd=repo_dir, env=INSTALL_ENV, log_path=log_path)
         if not ok:
             return False
+    # best effort, like the old "|| true"
+    run_cmd(pip + ["install", "pytest<9", "pytest-xdist", "wcag-contrast-ratio"], cwd=repo_dir, env=INSTALL_ENV, log_path=log_path)
+    ready_marker.touch()
     return True
 
-def run_tests(repo_dir, test_cmd):
-    """Run tests inside venv with PYTEST_DISABLE_PLUGIN_AUTOLOAD=1."""
-    activate = "source .venv/bin/activate"
-    env_prefix = "PYTEST_DISABLE_PLUGIN_AUTOLOAD=1"
-    full_cmd = f"{activate} && {env_prefix} {test_cmd}"
-    ok, out = run_cmd(full_cmd, cwd=repo_dir)
+def has_xdist(repo_dir):
+    """Whether pytest-xdist is importable in repo_dir's venv (cached per venv)."""
+    venv_dir = (repo_dir / ".venv").resolve()
+    if venv_dir not in _XDIST_AVAILABLE:
+        ok, _ = run_cmd([str(venv_python(repo_dir)), "-c", "import xdist"], cwd=repo_dir)
+        _XDIST_AVAILABLE[venv_dir] = ok
+    return _XDIST_AVAILABLE[venv_dir]
+
+def pytest_args(repo_dir, test_targets):
+    """Build the pytest argv (after `python -m pytest`) for test_targets."""
+    args = ["-x", "-p", "no:cacheprovider"]
+    if DEBUG_TESTS:
+        args.append("-vs")
+    # Several test files: spread them over xdist workers. Plugin autoload is
+    # off, so xdist has to be loaded explicitly with -p.
+    if len(test_targets) > 1 and has_xdist(repo_dir):
+        n = min(len(test_targets), os.cpu_count() or 1)
+        args += ["-p", "xdist", "-n", str(n), "--dist=loadfile"]
+    return args + list(test_targets)
+
+def run_tests(repo_dir, test_targets, log_path=None):
+    """Run pytest on test_targets using the venv's python, with PYTEST_DISABLE_PLUGIN_AUTOLOAD=1."""
+    env = {**os.environ, "PYTEST_DISABLE_PLUGIN_AUTOLOAD": "1"}
+    cmd = [str(venv_python(repo_dir)), "-m", "pytest", *pytest_args(repo_dir, test_targets)]
+    ok, out = run_cmd(cmd, cwd=repo_dir, env=env, log_path=log_path)
     return ok, out
 
-def apply_patch(repo_dir, patch_text, label):
+def apply_patch(repo_dir, patch_text, label, log_path=None):
     """Apply a unified diff (patch_text) to repo via git apply."""
     if not patch_text:
         print(f"[WARN] No {label} patch text; skipping apply.")
@@ -99,47 +276,283 @@ def apply_patch(repo_dir, patch_text, label):
     # write patch to temp file under repo
     patch_file = repo_dir / f"{label}.patch"
     patch_file.write_text(patch_text)
-    cmd = f"git apply --index --reject --whitespace=nowarn {patch_file.name}"
-    ok, _ = run_cmd(cmd, cwd=repo_dir)
+    cmd = ["git", "apply", "--index", "--reject", "--whitespace=nowarn", patch_file.name]
+    ok, _ = run_cmd(cmd, cwd=repo_dir, log_path=log_path)
     if not ok:
         print(f"[ERROR] Failed to apply {label} patch ({patch_file}).")
     return ok
 
 def extract_test_files_from_patch(patch_text):
     """Extract test file paths from a unified diff patch."""
-    import re
     if not patch_text:
         return []
-    
-    test_files = []
-    for line in patch_text.split('\n'):
-        if line.startswith('diff --git'):
-            # Extract file path from: diff --git a/path/to/file.py b/path/to/file.py
-            match = re.search(r'b/(.*test.*\.py)', line, re.IGNORECASE)
-            if match:
-                test_file = match.group(1)
-                if test_file not in test_files:
-                    test_files.append(test_file)
-    
-    return test_files
+
+    test_files = {}  # dict keeps first-seen order while deduplicating
+    for line in patch_text.splitlines():
+        if not line.startswith("diff --git"):
+            continue
+        # Extract file path from: diff --git a/path/to/file.py b/path/to/file.py
+        match = _TEST_FILE_RE.search(line)
+        if match:
+            test_files[match.group(1)] = None
+
+    return list(test_files)
+
+def load_oracle_features(oracle_file):
+    """Read one oracle_lite.json and return its features dict, or None if unreadable."""
+    try:
+        data = orjson.loads(oracle_file.read_bytes())
+        return data.get("features", {})
+    except Exception as e:
+        print(f"[ERROR] Failed to load {oracle_file}: {e}")
+        return None
 
 def load_completed_tasks(results_path):
-    """Load already-completed tasks from results file to enable resuming."""
+    """
+    Load already-completed tasks from results file to enable resuming.
+
+    Tasks are keyed by instance_id, since several instances can share a
+    (repo, base_commit). Records written before instance_id was stored fall
+    back to their (repo, base_commit) tuple.
+    """
     completed = set()
     if results_path.exists():
         print(f"[INFO] Found existing results file: {results_path}")
         try:
-            with open(results_path) as f:
-                for line in f:
-                    if line.strip():
-                        result = json.loads(line)
-                        key = (result["repo"], result["base_commit"])
-                        completed.add(key)
+            for result in iter_jsonl(results_path):
+                key = result.get("instance_id") or (result["repo"], result["base_commit"])
+                completed.add(key)
             print(f"[INFO] Found {len(completed)} already-completed tasks. Will skip them.")
         except Exception as e:
             print(f"[WARN] Error reading results file: {e}. Starting fresh.")
     return completed
 
+def add_worktree(repo_dir, wt_dir, base_commit, log_path=None):
+    """Check out base_commit into a detached worktree at wt_dir (replacing a stale one)."""
+    if wt_dir.exists():
+        remove_worktree(repo_dir, wt_dir, log_path=log_path)
+    wt_dir.parent.mkdir(parents=True, exist_ok=True)
+    ok, _ = run_cmd(["git", "worktree", "add", "--detach", "--force", str(wt_dir), base_commit], cwd=repo_dir, log_path=log_path)
+    return ok
+
+def remove_worktree(repo_dir, wt_dir, log_path=None):
+    """Remove a worktree created by add_worktree."""
+    ok, _ = run_cmd(["git", "worktree", "remove", "--force", str(wt_dir)], cwd=repo_dir, log_path=log_path)
+    if not ok and wt_dir.exists():
+        shutil.rmtree(wt_dir, ignore_errors=True)
+        run_cmd(["git", "worktree", "prune"], cwd=repo_dir, log_path=log_path)
+
+def run_patch_phase(wt_dir, repo_name, phase, patches, test_targets, log_path=None):
+    """
+    Apply patches (list of (label, patch_text)) in a worktree, install and run tests.
+
+    Each phase worktree gets its own cached venv (keyed by repo and phase) so
+    the two concurrent phases never share an editable install.
+
+    Returns:
+        (status, error_note) where error_note is None unless status is "ERROR"
+    """
+    for label, patch_text in patches:
+        if not apply_patch(wt_dir, patch_text, label, log_path=log_path):
+            suffix = "" if label == phase else f"_{phase.split('_')[0]}_phase"
+            return "ERROR", f"apply_{label}_failed{suffix}"
+    if not create_venv_and_install(wt_dir, log_path=log_path, cache_name=f"{repo_name}__{phase}"):
+        return "ERROR", f"venv_install_failed_{phase}"
+    ok, _ = run_tests(wt_dir, test_targets, log_path=log_path)
+    return ("PASS" if ok else "FAIL"), None
+
+def run_baseline(repo_dir, base_commit, test_targets, log_path=None):
+    """Reset to base_commit, install and run tests; return (status, error_note)."""
+    if not reset_to_base(repo_dir, base_commit, log_path=log_path):
+        return "ERROR", "reset_failed_baseline"
+    if not create_venv_and_install(repo_dir, log_path=log_path):
+        return "ERROR", "venv_install_failed_baseline"
+    base_ok, _ = run_tests(repo_dir, test_targets, log_path=log_path)
+    return ("PASS" if base_ok else "FAIL"), None
+
+def process_task(info, baseline_cache=None):
+    """
+    Run the baseline / test_patch / fix_patch phases for one task and return its result.
+
+    baseline_cache (dict, shared across the tasks of one repo group) maps
+    (base_commit, test_targets) to an earlier baseline (status, error_note).
+    """
+    instance_id = info["instance_id"]
+    repo_slug = info["repo"]
+    base_commit = info["base"]
+    print("\n====================================================")
+    print(f"Processing {instance_id} ({repo_slug} @ {base_commit})")
+    print(f"Test targets: {shlex.join(info['test_targets'])}")
+    print("====================================================")
+
+    # one directory per task, one log per phase
+    log_dir = LOG_ROOT / instance_id
+    log_dir.mkdir(parents=True, exist_ok=True)
+    base_log = log_dir / "baseline.log"
+    test_log = log_dir / "test_patch.log"
+    fix_log = log_dir / "fix_patch.log"
+
+    repo_dir = ensure_repo_cloned(repo_slug, base_commit, log_path=log_dir / "clone.log")
+    if repo_dir is None:
+        return {
+            "instance_id": instance_id,
+            "repo": repo_slug,
+            "base_commit": base_commit,
+            "baseline": "ERROR",
+            "test_patch": "SKIP",
+            "fix_patch": "SKIP",
+            "note": "clone_failed",
+        }
+
+    # BASELINE: identical for every task with the same base commit and test
+    # selection, so it runs once per (base_commit, test_targets) within a repo group
+    baseline_key = (base_commit, tuple(info["test_targets"]))
+    if baseline_cache is not None and baseline_key in baseline_cache:
+        print(f"[INFO] Reusing baseline result for {base_commit}")
+        base_status, base_note = baseline_cache[baseline_key]
+    else:
+        base_status, base_note = run_baseline(repo_dir, base_commit, info["test_targets"], log_path=base_log)
+        if baseline_cache is not None:
+            baseline_cache[baseline_key] = (base_status, base_note)
+
+    if base_status == "ERROR":
+        return {
+            "instance_id": instance_id,
+            "repo": repo_slug,
+            "base_commit": base_commit,
+            "baseline": "ERROR",
+            "test_patch": "SKIP",
+            "fix_patch": "SKIP",
+            "note": base_note,
+        }
+
+    # TEST PATCH (base + test_patch) and FIX PATCH (base + test_patch + fix_patch)
+    # run side by side, each in its own worktree of the base commit
+    phases = {
+        "test_patch": [("test_patch", info["test_patch"])],
+        "fix_patch": [("test_patch", info["test_patch"]), ("fix_patch", info["fix_patch"])],
+    }
+    phase_logs = {"test_patch": test_log, "fix_patch": fix_log}
+    worktrees = {}
+    try:
+        for phase in phases:
+            wt_dir = WORKTREE_ROOT / repo_dir.name / phase
+            if not add_worktree(repo_dir, wt_dir, base_commit, log_path=phase_logs[phase]):
+                return {
+                    "instance_id": instance_id,
+                    "repo": repo_slug,
+                    "base_commit": base_commit,
+                    "baseline": base_status,
+                    "test_patch": "ERROR" if phase == "test_patch" else "SKIP",
+                    "fix_patch": "SKIP" if phase == "test_patch" else "ERROR",
+                    "note": f"worktree_failed_{phase}",
+                }
+            worktrees[phase] = wt_dir
+
+        with ThreadPoolExecutor(max_workers=len(phases)) as ex:
+            futures = {
+                phase: ex.submit(
+                    run_patch_phase, worktrees[phase], repo_dir.name, phase, patches,
+                    info["test_targets"], phase_logs[phase],
+                )
+                for phase, patches in phases.items()
+            }
+            test_status, test_note = futures["test_patch"].result()
+            fix_status, fix_note = futures["fix_patch"].result()
+    finally:
+        for wt_dir in worktrees.values():
+            remove_worktree(repo_dir, wt_dir, log_path=log_dir / "clone.log")
+
+    if test_note is not None:
+        # fix_patch builds on test_patch: not meaningful when test_patch errored
+        fix_status = "SKIP"
+
+    return {
+        "instance_id": instance_id,
+        "repo": repo_slug,
+        "base_commit": base_commit,
+        "baseline": base_status,
+        "test_patch": test_status,
+        "fix_patch": fix_status,
+        "note": test_note or fix_note or "ok",
+    }
+
+
+def prewarm_wheels(infos):
+    """
+    Build wheels for the dependencies of one repo into WHEEL_CACHE.
+
+    Runs `pip wheel` once per distinct dependency fingerprint among the repo's
+    base commits, so the later installs (which see WHEEL_CACHE through
+    PIP_FIND_LINKS / UV_FIND_LINKS) skip downloads and builds.
+
+    Best effort: any error is logged and reported as False, never raised.
+
+    Returns:
+        True if every wheel build succeeded
+    """
+    try:
+        return _prewarm_wheels(infos)
+    except Exception as e:
+        print(f"[WARN] Wheel pre-warm failed for {infos[0]['repo']}: {type(e).__name__}: {e}")
+        return False
+
+def _prewarm_wheels(infos):
+    first = infos[0]
+    log_dir = LOG_ROOT / first["instance_id"]
+    log_dir.mkdir(parents=True, exist_ok=True)
+    log_path = log_dir / "prewarm.log"
+
+    repo_dir = ensure_repo_cloned(first["repo"], first["base"], log_path=log_path)
+    if repo_dir is None:
+        return False
+
+    ok = True
+    seen = set()
+    for base_commit in dict.fromkeys(info["base"] for info in infos):
+        if not reset_to_base(repo_dir, base_commit, log_path=log_path):
+            ok = False
+            continue
+        fingerprint = venv_fingerprint(repo_dir)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        built, _ = run_cmd(
+            ["python3", "-m", "pip", "wheel", "--wheel-dir", str(WHEEL_CACHE), "."],
+            cwd=repo_dir, env=INSTALL_ENV, log_path=log_path,
+        )
+        ok = ok and built
+    return ok
+
+def run_repo_group(infos, result_queue):
+    """
+    Process all tasks of one repo in order, in a single worker.
+
+    Tasks of the same repo share one clone directory, so they must not run
+    concurrently with each other. Tasks are ordered by base commit so
+    instances sharing a base run back to back and reuse its baseline.
+
+    Each result is put on result_queue as soon as its task finishes, so the
+    parent can record it even if the run is killed mid-group. An exception
+    in one task is recorded as an ERROR result and the group carries on.
+    """
+    baseline_cache = {}
+    for info in sorted(infos, key=lambda info: info["base"]):
+        try:
+            result = process_task(info, baseline_cache)
+        except Exception as e:
+            print(f"[ERROR] {info['instance_id']} raised {type(e).__name__}: {e}")
+            result = {
+                "instance_id": info["instance_id"],
+                "repo": info["repo"],
+                "base_commit": info["base"],
+                "baseline": "ERROR",
+                "test_patch": "SKIP",
+                "fix_patch": "SKIP",
+                "note": f"exception: {type(e).__name__}: {e}",
+            }
+        result_queue.put(result)
+
 def main():
     # ----- 1. Load tasks from Oracle dataset -----
     tasks = []
@@ -150,55 +563,71 @@ def main():
         print(f"[ERROR] index.csv not found at {index_csv}")
         return
     
-    with open(index_csv) as f:
-        reader = csv.DictReader(f)
+    # Collect candidate files first, then parse them
+    oracle_files = []
+    with open(index_csv, newline="") as f:
+        # Plain reader + column index: only repo_folder is needed, no dict per row
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if "repo_folder" not in header:
+            print(f"[ERROR] index.csv has no repo_folder column: {index_csv}")
+            return
+        folder_idx = header.index("repo_folder")
         for row in reader:
-            repo_folder = Path(row['repo_folder'])
+            if len(row) <= folder_idx:
+                continue  # blank line (DictReader skipped these too)
+            repo_folder = Path(row[folder_idx])
             instances_dir = repo_folder / "instances"
             
             if not instances_dir.exists():
                 print(f"[WARN] Instances directory not found: {instances_dir}")
                 continue
             
-            for inst_dir in instances_dir.iterdir():
-                if inst_dir.is_dir():
-                    oracle_file = inst_dir / "oracle_lite.json"
-                    if oracle_file.exists():
-                        try:
-                            with open(oracle_file) as jf:
-                                data = json.load(jf)
-                                features = data.get("features", {})
-                                
-                                repo = features.get("repo")
-                                base = features.get("base_commit")
-                                test_patch = features.get("test_patch", "")
-                                fix_patch = features.get("patch", "")
-                                
-                                if not repo or not base:
-                                    print(f"[WARN] Missing repo or base_commit in {oracle_file}")
-                                    continue
-                                
-                                # Extract test files from test_patch
-                                test_files = extract_test_files_from_patch(test_patch)
-                                
-                                # Build test command
-                                if test_files:
-                                    # Run only the specific test files mentioned in test_patch
-                                    test_cmd = f"python -m pytest -xvs {' '.join(test_files)}"
-                                else:
-                                    # Fallback: try running tests directory
-                                    test_cmd = "python -m pytest -xvs tests/"
-                                
-                                tasks.append({
-                                    "repo": repo,
-                                    "base": base,
-                                    "test_patch": test_patch,
-                                    "fix_patch": fix_patch,
-                                    "test_cmd": test_cmd,
-                                })
-                        except Exception as e:
-                            print(f"[ERROR] Failed to load {oracle_file}: {e}")
-                            continue
+            # scandir's DirEntry.is_dir() reuses the readdir record (no extra stat per entry)
+            with os.scandir(instances_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        oracle_file = Path(entry.path) / "oracle_lite.json"
+                        if oracle_file.exists():
+                            oracle_files.append(oracle_file)
+
+    # Reading/parsing is I/O bound on the shared filesystem: do it on a thread pool
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as ex:
+        loaded = list(zip(oracle_files, ex.map(load_oracle_features, oracle_files)))
+
+    for oracle_file, features in loaded:
+        if features is None:
+            continue
+
+        instance_id = features.get("instance_id")
+        repo = features.get("repo")
+        base = features.get("base_commit")
+        test_patch = features.get("test_patch", "")
+        fix_patch = features.get("patch", "")
+
+        if not repo or not base or not instance_id:
+            print(f"[WARN] Missing instance_id, repo or base_commit in {oracle_file}")
+            continue
+
+        # Extract test files from test_patch
+        test_files = extract_test_files_from_patch(test_patch)
+
+        # Pick what pytest runs (flags are added by run_tests)
+        if test_files:
+            # Run only the specific test files mentioned in test_patch
+            test_targets = test_files
+        else:
+            # Fallback: try running tests directory
+            test_targets = ["tests/"]
+
+        tasks.append({
+            "instance_id": instance_id,
+            "repo": repo,
+            "base": base,
+            "test_patch": test_patch,
+            "fix_patch": fix_patch,
+            "test_targets": test_targets,
+        })
 
     print(f"Found {len(tasks)} tasks from Oracle dataset.")
 
@@ -208,166 +637,61 @@ def main():
     # Filter out completed tasks
     if completed_tasks:
         original_count = len(tasks)
-        tasks = [t for t in tasks if (t["repo"], t["base"]) not in completed_tasks]
+        tasks = [
+            t for t in tasks
+            if t["instance_id"] not in completed_tasks and (t["repo"], t["base"]) not in completed_tasks
+        ]
         skipped = original_count - len(tasks)
         print(f"[INFO] Skipped {skipped} already-completed tasks")
         print(f"[INFO] {len(tasks)} tasks remaining to process")
 
     # ----- 2. Run PoC for each task -----
-    results = []
-    repos_processed = set()  # Track unique repos processed
-    MAX_REPOS = 300  # Stop after processing this many repos (comment out to run all)
-    
+    # Group by repo so one worker owns each clone directory; repos run in parallel
+    groups = {}
     for info in tasks:
-        repo_slug = info["repo"]
-        base_commit = info["base"]
-        print("\n====================================================")
-        print(f"Processing {repo_slug} @ {base_commit}")
-        print(f"Test command: {info['test_cmd']}")
-        print("====================================================")
-
-        repo_dir = ensure_repo_cloned(repo_slug)
-        if repo_dir is None:
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": "ERROR",
-                "test_patch": "SKIP",
-                "fix_patch": "SKIP",
-                "note": "clone_failed",
-            })
-            continue
-
-        # BASELINE
-        if not reset_to_base(repo_dir, base_commit):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": "ERROR",
-                "test_patch": "SKIP",
-                "fix_patch": "SKIP",
-                "note": "reset_failed_baseline",
-            })
-            continue
-
-        if not create_venv_and_install(repo_dir):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": "ERROR",
-                "test_patch": "SKIP",
-                "fix_patch": "SKIP",
-                "note": "venv_install_failed_baseline",
-            })
-            continue
-
-        base_ok, _ = run_tests(repo_dir, info["test_cmd"])
-        base_status = "PASS" if base_ok else "FAIL"
-
-        # TEST PATCH: base + test_patch
-        if not reset_to_base(repo_dir, base_commit):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": base_status,
-                "test_patch": "ERROR",
-                "fix_patch": "SKIP",
-                "note": "reset_failed_test_patch",
-            })
-            continue
+        groups.setdefault(info["repo"], []).append(info)
+    grouped = list(groups.values())[:MAX_REPOS]
+    if len(groups) > MAX_REPOS:
+        print(f"[INFO] Limiting run to the first {MAX_REPOS} repos")
+
+    if PREWARM_WHEELS and grouped:
+        # one thread per repo, so no clone directory is shared between threads
+        print(f"[INFO] Pre-warming wheel cache for {len(grouped)} repos ...")
+        # clones/fetches go to GitHub: same concurrency cap as the task workers
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            warmed = sum(ex.map(prewarm_wheels, grouped))
+        print(f"[INFO] Pre-warmed wheels for {warmed}/{len(grouped)} repos in {WHEEL_CACHE}")
+
+    workers = max(1, min(MAX_WORKERS, (os.cpu_count() or 2) // 2))
+    print(f"[INFO] Processing {len(grouped)} repos with {workers} workers")
 
-        if not apply_patch(repo_dir, info["test_patch"], "test_patch"):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": base_status,
-                "test_patch": "ERROR",
-                "fix_patch": "SKIP",
-                "note": "apply_test_patch_failed",
-            })
-            continue
-
-        if not create_venv_and_install(repo_dir):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": base_status,
-                "test_patch": "ERROR",
-                "fix_patch": "SKIP",
-                "note": "venv_install_failed_test_patch",
-            })
-            continue
-
-        test_ok, _ = run_tests(repo_dir, info["test_cmd"])
-        test_status = "PASS" if test_ok else "FAIL"
-
-        # FIX PATCH: base + test_patch + fix_patch
-        if not reset_to_base(repo_dir, base_commit):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": base_status,
-                "test_patch": test_status,
-                "fix_patch": "ERROR",
-                "note": "reset_failed_fix_patch",
-            })
-            continue
-
-        if not apply_patch(repo_dir, info["test_patch"], "test_patch"):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": base_status,
-                "test_patch": test_status,
-                "fix_patch": "ERROR",
-                "note": "apply_test_patch_failed_fix_phase",
-            })
-            continue
-
-        if not apply_patch(repo_dir, info["fix_patch"], "fix_patch"):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": base_status,
-                "test_patch": test_status,
-                "fix_patch": "ERROR",
-                "note": "apply_fix_patch_failed",
-            })
-            continue
-
-        if not create_venv_and_install(repo_dir):
-            results.append({
-                "repo": repo_slug,
-                "base_commit": base_commit,
-                "baseline": base_status,
-                "test_patch": test_status,
-                "fix_patch": "ERROR",
-                "note": "venv_install_failed_fix_patch",
-            })
-            continue
-
-        fix_ok, _ = run_tests(repo_dir, info["test_cmd"])
-        fix_status = "PASS" if fix_ok else "FAIL"
-
-        results.append({
-            "repo": repo_slug,
-            "base_commit": base_commit,
-            "baseline": base_status,
-            "test_patch": test_status,
-            "fix_patch": fix_status,
-            "note": "ok",
-        })
-
-        # write incremental result to disk so progress is not lost
-        with RESULTS_PATH.open("a") as out_f:
-            out_f.write(json.dumps(results[-1]) + "\n")
-        
-        # Track repos processed and stop after MAX_REPOS (for testing)
-        repos_processed.add(repo_slug)
-        if len(repos_processed) >= MAX_REPOS:
-            print(f"\n[INFO] Stopping after processing {MAX_REPOS} repos (for testing)")
-            print(f"[INFO] Processed repos: {', '.join(sorted(repos_processed))}")
-            break
+    results = []
+    # One line-buffered handle for the whole run, written by the parent only so
+    # workers never share the file; each line is flushed as it is written
+    results_fh = RESULTS_PATH.open("a", buffering=1)
+    try:
+        with Manager() as manager, ProcessPoolExecutor(max_workers=workers) as ex:
+            # Workers report every task as it finishes; the parent drains the
+            # queue until all groups are done, then picks up what is left
+            result_queue = manager.Queue()
+            pending = {ex.submit(run_repo_group, infos, result_queue): infos[0]["repo"] for infos in grouped}
+            while pending or not result_queue.empty():
+                try:
+                    res = result_queue.get(timeout=1)
+                except queue.Empty:
+                    for future in [f for f in pending if f.done()]:
+                        repo = pending.pop(future)
+                        exc = future.exception()
+                        if exc is not None:
+                            # e.g. BrokenProcessPool; tasks already reported are kept
+                            print(f"[ERROR] Worker for {repo} failed: {type(exc).__name__}: {exc}")
+                    continue
+
+                results.append(res)
+                if res["note"] == "ok":
+                    results_fh.write(json.dumps(res) + "\n")
+    finally:
+        results_fh.close()
 
     # ----- 3. Print Summary Statistics -----
     print("\n" + "="*60)
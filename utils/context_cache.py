@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from google.genai import errors as genai_errors
+from google.genai import types
+
+from utils.generate_patch import _is_retryable, call_rate_limited, get_gemini_client
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL_S = 3600
+CACHE_TTL = f"{CACHE_TTL_S}s"
+# A cache still in use is extended by another CACHE_TTL once it is this old
+CACHE_REFRESH_S = CACHE_TTL_S // 2
+
+
+class ContextCaches:
+    """
+    Gemini cached contents, one per distinct prompt prefix, created on first use.
+
+    Each cache holds the system instruction plus a repository documentation
+    prefix (see build_repo_context), so requests for the same repo only send
+    the task-specific part of the prompt. Tasks run in repo order, so a
+    repo's cache is created when the dispatcher reaches its first task
+    rather than for every repo up front (where caches of late repos would
+    expire before use); caches in use for longer than CACHE_REFRESH_S get
+    their TTL extended. Create and update calls share the model calls' RPM
+    limiter and 429/503 retry policy.
+    """
+
+    def __init__(self, model: str, system_instruct: str):
+        """
+        Args:
+            model: Gemini model the caches are created for
+            system_instruct: System instruction stored in every cache
+        """
+        self.model = model
+        self.system_instruct = system_instruct
+        self._names: Dict[str, "asyncio.Future[Optional[str]]"] = {}  # prefix -> cache name
+        self._refreshed: Dict[str, float] = {}  # cache name -> time its TTL was last set
+
+    async def get(self, prefix: str) -> Optional[str]:
+        """
+        Return the cache name for prefix, creating the cache on first use.
+
+        Concurrent callers for the same prefix share one create call. A
+        refusal (e.g. prefix below the minimum cacheable token count) is
+        remembered for the rest of the run; a transient failure is not, so
+        the next task of the repo tries again.
+
+        Args:
+            prefix: Prompt prefix to cache
+
+        Returns:
+            Cache name, or None if prefix is empty or no cache is available
+        """
+        if not prefix:
+            return None
+        future = self._names.get(prefix)
+        if future is None:
+            future = asyncio.ensure_future(self._create(prefix))
+            self._names[prefix] = future
+        try:
+            name = await future
+        except Exception:
+            # Transient failure (logged by _create): forget it so a later task retries
+            if self._names.get(prefix) is future:
+                del self._names[prefix]
+            return None
+        if name and time.monotonic() - self._refreshed[name] > CACHE_REFRESH_S:
+            # Marked before the await so concurrent callers don't all extend it
+            last_refreshed = self._refreshed[name]
+            self._refreshed[name] = time.monotonic()
+            await self._extend(name, last_refreshed)
+        return name
+
+    async def _create(self, prefix: str) -> Optional[str]:
+        client = get_gemini_client()
+        config = types.CreateCachedContentConfig(
+            system_instruction=self.system_instruct,
+            contents=[prefix],
+            ttl=CACHE_TTL,
+        )
+        try:
+            cache = await call_rate_limited(lambda: client.aio.caches.create(model=self.model, config=config))
+        except genai_errors.ClientError as e:
+            if _is_retryable(e):
+                logger.warning(f"[WARN] Context cache not created, will retry on a later task: {e}")
+                raise
+            # Refused for this prefix (4xx): don't ask again this run
+            logger.warning(f"[WARN] Context cache not created, sending full prompt instead: {e}")
+            return None
+        except Exception as e:
+            logger.warning(f"[WARN] Context cache not created, will retry on a later task: {e}")
+            raise
+        self._refreshed[cache.name] = time.monotonic()
+        return cache.name
+
+    async def _extend(self, name: str, last_refreshed: float) -> None:
+        client = get_gemini_client()
+        config = types.UpdateCachedContentConfig(ttl=CACHE_TTL)
+        try:
+            await call_rate_limited(lambda: client.aio.caches.update(name=name, config=config))
+        except Exception as e:
+            # Restore the old time so the next task using the cache tries again
+            self._refreshed[name] = last_refreshed
+            logger.warning(f"[WARN] Failed to extend context cache {name}: {e}")
+
+    async def close(self) -> None:
+        """Delete the caches created so far instead of waiting for their TTL."""
+        names = [
+            future.result() for future in self._names.values()
+            if future.done() and not future.cancelled() and future.exception() is None and future.result()
+        ]
+        logger.info(f"[INFO] Used {len(names)}/{len(self._names)} Gemini context caches")
+        client = get_gemini_client()
+        for name in names:
+            try:
+                await client.aio.caches.delete(name=name)
+            except Exception as e:
+                logger.warning(f"[WARN] Failed to delete context cache {name}: {e}")
@@ -0,0 +1,67 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable, List
+
+import orjson
+
+# Number of task coroutines kept alive at once (the rolling submission window)
+MAX_INFLIGHT = int(os.environ.get("FEA_MAX_INFLIGHT", 32))
+
+
+async def run_windowed(process_task: Callable[..., Awaitable[Any]], task_args: Iterable[tuple], max_inflight: int = MAX_INFLIGHT) -> List[Any]:
+    """
+    Run process_task over task_args keeping at most max_inflight coroutines alive.
+
+    Instead of creating every coroutine up front (one gather over thousands of
+    tasks), the window is primed with max_inflight tasks and topped up by one
+    each time a task completes.
+
+    Args:
+        process_task: Coroutine function called as process_task(*args)
+        task_args: Iterable of argument tuples, one per task
+        max_inflight: Size of the submission window
+
+    Returns:
+        List of task results in completion order
+    """
+    results = []
+    args_iter = iter(task_args)
+    pending = set()
+
+    def submit_next() -> None:
+        args = next(args_iter, None)
+        if args is not None:
+            pending.add(asyncio.ensure_future(process_task(*args)))
+
+    for _ in range(max(1, max_inflight)):
+        submit_next()
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            results.append(future.result())
+            submit_next()
+
+    return results
+
+
+async def write_results(queue: asyncio.Queue, results_file: Path) -> None:
+    """
+    Append results from the queue to the results file, one JSON line each.
+
+    Being the only writer keeps JSONL lines from interleaving when many
+    tasks finish at the same time.
+
+    Args:
+        queue: Queue of result dictionaries; a None item stops the writer
+        results_file: Path to the JSONL results file
+    """
+    # Opened once for the whole run; flushing after each line keeps results crash-safe
+    with open(results_file, "ab", buffering=1024 * 1024) as f:
+        while True:
+            result = await queue.get()
+            if result is None:
+                break
+            f.write(orjson.dumps(result) + b"\n")
+            f.flush()
@@ -1,45 +1,219 @@
+import asyncio
+import logging
 import os
+import re
+import warnings
+from functools import lru_cache
+from pathlib import Path
 
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
-from typing import Dict, List, Optional, Any
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 
-from openai import OpenAI
+import httpx
+from openai import APIStatusError, AsyncOpenAI, DefaultAsyncHttpxClient
+from aiolimiter import AsyncLimiter
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
-def generate_gemini(prompt: str, instance_id: str, model: str, system_instruct: str):
-    # Initialize Gemini client (uses GEMINI_API_KEY env var)
-    client = genai.Client()
-    
-    print(f"  [Gemini] Generating patch for {instance_id}...")
-    
-    response = client.models.generate_content(
-        model=model,
-        config=types.GenerateContentConfig(
-            system_instruction=system_instruct,
-            temperature=0.2,  # Lower temperature for more consistent output
-        ),
-        contents=prompt
+from utils import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Client-side request budget (requests per minute) shared by every call in the process
+RPM = int(os.environ.get("FEA_RPM", 60))
+_rpm_limiter = AsyncLimiter(RPM, 60)
+# The sync wrappers run each call in its own asyncio.run but keep this limiter so
+# the budget carries over between calls; every loop drains its waiters before it
+# closes, so aiolimiter's cross-loop reuse warning does not apply
+warnings.filterwarnings("ignore", message="This AsyncLimiter instance is being re-used across loops", category=RuntimeWarning)
+
+# A patch response must start with one of these; streamed responses that don't
+# are aborted once PREFIX_CHECK_CHARS characters have arrived
+PATCH_PREFIXES = ("diff", "---")
+PREFIX_CHECK_CHARS = 20
+
+# Body of a ``` fenced block (optional language tag); fences must start a line
+_FENCE_RE = re.compile(r"^[ \t]*```[\w+-]*[ \t]*\n(.*?)^[ \t]*```", re.MULTILINE | re.DOTALL)
+
+# Connection pool sized for the async dispatcher so concurrent requests reuse
+# keep-alive connections instead of paying a TCP+TLS handshake each
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=64)
+HTTP_TIMEOUT_S = 600
+
+# Client factories are cached: the first call builds the client, every later
+# call returns it, so all requests share one connection pool
+@lru_cache(maxsize=None)
+def get_gemini_client() -> genai.Client:
+    """Return the process-wide Gemini client (uses GEMINI_API_KEY env var)."""
+    return genai.Client(
+        http_options=types.HttpOptions(
+            timeout=HTTP_TIMEOUT_S * 1000,  # milliseconds
+            async_client_args={"limits": HTTP_LIMITS},
+        )
     )
+
+@lru_cache(maxsize=None)
+def get_deepseek_client() -> AsyncOpenAI:
+    """Return the process-wide DeepSeek client (uses DEEPSEEK_API_KEY env var)."""
+    return AsyncOpenAI(
+        api_key=os.environ.get('DEEPSEEK_API_KEY'),
+        base_url="https://api.deepseek.com",
+        timeout=HTTP_TIMEOUT_S,
+        http_client=DefaultAsyncHttpxClient(limits=HTTP_LIMITS),
+    )
+
+async def _collect_stream(stream, chunk_text: Callable[[Any], Optional[str]], close: Callable[[], Awaitable[None]], expect_prefixes: Tuple[str, ...], instance_id: str) -> Optional[str]:
+    """
+    Accumulate a streamed response, aborting as soon as its start rules it out.
     
-    return(response.text)
+    Args:
+        stream: Async iterator of response chunks
+        chunk_text: Extracts the text of one chunk
+        close: Closes the stream (cancels the remaining decode)
+        expect_prefixes: Allowed starts of the response (leading whitespace ignored)
+        instance_id: Instance ID for logging
+        
+    Returns:
+        Full response text, or None if the response was aborted
+    """
+    parts = []
+    checked = False
+    async for chunk in stream:
+        parts.append(chunk_text(chunk) or "")
+        if not checked:
+            head = "".join(parts).lstrip()
+            if len(head) >= PREFIX_CHECK_CHARS:
+                checked = True
+                if not head.startswith(expect_prefixes):
+                    await close()
+                    logger.warning(f"[WARN] Aborted response for {instance_id}, starts with {head[:PREFIX_CHECK_CHARS]!r}")
+                    return None
+    return "".join(parts)
 
-def generate_deepseek(prompt: str, instance_id: str, model: str, system_instruct: str):
+async def generate_gemini_async(prompt: str, instance_id: str, model: str, system_instruct: str, context_cache: Optional[Tuple[str, str]] = None, expect_prefixes: Optional[Tuple[str, ...]] = None):
+    client = get_gemini_client()
+    
+    logger.debug(f"[Gemini] Generating patch for {instance_id}...")
     
-    client = OpenAI(api_key=os.environ.get('DEEPSEEK_API_KEY'), base_url="https://api.deepseek.com")
+    async def send(config: types.GenerateContentConfig, contents: str):
+        if expect_prefixes:
+            stream = await client.aio.models.generate_content_stream(
+                model=model,
+                config=config,
+                contents=contents
+            )
+            return await _collect_stream(stream, lambda chunk: chunk.text, stream.aclose, expect_prefixes, instance_id)
+        
+        response = await client.aio.models.generate_content(
+            model=model,
+            config=config,
+            contents=contents
+        )
+        return response.text
+    
+    if context_cache and prompt.startswith(context_cache[1]):
+        # System instruction and repo documentation are already in the cache;
+        # only the task-specific remainder of the prompt is sent
+        cache_name, prefix = context_cache
+        try:
+            return await send(types.GenerateContentConfig(cached_content=cache_name, temperature=0.2), prompt[len(prefix):])
+        except genai_errors.ClientError as e:
+            if not _is_cache_miss(e):
+                raise
+            logger.warning(f"[WARN] Context cache {cache_name} unavailable for {instance_id}, sending full prompt: {e}")
+    
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruct,
+        temperature=0.2,  # Lower temperature for more consistent output
+    )
+    return await send(config, prompt)
+
+def _is_cache_miss(exc: genai_errors.ClientError) -> bool:
+    """A cached_content that expired or was deleted is reported as a 400/403/404 mentioning the cache."""
+    return exc.code in (400, 403, 404) and "cache" in str(exc).lower()
 
-    response = client.chat.completions.create(
+async def generate_deepseek_async(prompt: str, instance_id: str, model: str, system_instruct: str, expect_prefixes: Optional[Tuple[str, ...]] = None):
+    client = get_deepseek_client()
+
+    response = await client.chat.completions.create(
         model=model,
         temperature=0.2,
         messages=[
             {"role": "system", "content": system_instruct},
             {"role": "user", "content": prompt},
         ],
-    stream=False
+    stream=bool(expect_prefixes)
     )
 
+    if expect_prefixes:
+        return await _collect_stream(
+            response,
+            lambda chunk: chunk.choices[0].delta.content if chunk.choices else None,
+            response.close,
+            expect_prefixes,
+            instance_id,
+        )
+
     return(response.choices[0].message.content)
 
-def generate_doc(prompt: str, instance_id: str, model_type: str, model: str, system_instruct: str) -> Optional[str]:
+def _is_retryable(exc: BaseException) -> bool:
+    """Rate-limit (429) and overload (503) errors from either provider are worth retrying."""
+    # openai's .code is the error-body code string; the HTTP status is .status_code
+    if isinstance(exc, APIStatusError):
+        status = exc.status_code
+    elif isinstance(exc, genai_errors.APIError):
+        status = exc.code
+    else:
+        return False
+    return status in (429, 503)
+
+async def call_rate_limited(call: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Await call() under the RPM limiter, retrying 429/503 with jittered backoff.
+    
+    Args:
+        call: Zero-argument function returning the API coroutine (called anew per attempt)
+        
+    Returns:
+        Result of the first successful attempt; the last error is re-raised
+    """
+    async for attempt in AsyncRetrying(
+        stop=stop_after_attempt(5),
+        wait=wait_exponential_jitter(1, 30),
+        retry=retry_if_exception(_is_retryable),
+        reraise=True,
+    ):
+        with attempt:
+            async with _rpm_limiter:
+                result = await call()
+    return result
+
+async def _call_model(prompt: str, instance_id: str, model_type: str, model: str, system_instruct: str, context_cache: Optional[Tuple[str, str]] = None, use_cache: bool = True, expect_prefixes: Optional[Tuple[str, ...]] = None):
+    """
+    Call the requested model under the RPM limiter, retrying 429/503 with jittered backoff.
+    
+    Responses are looked up in (and saved to) the on-disk response cache
+    first unless use_cache is False. With expect_prefixes the response is
+    streamed and abandoned (None) as soon as it starts with anything else.
+    """
+    key = response_cache.make_key(model, system_instruct, prompt) if use_cache else None
+    if key:
+        cached = response_cache.get(key)
+        if cached is not None:
+            logger.info(f"[CACHE] Using cached response for {instance_id}")
+            return cached
+
+    if model_type == "gemini":
+        text = await call_rate_limited(lambda: generate_gemini_async(prompt, instance_id, model, system_instruct, context_cache, expect_prefixes))
+    else:
+        text = await call_rate_limited(lambda: generate_deepseek_async(prompt, instance_id, model, system_instruct, expect_prefixes))
+
+    if key and text:
+        response_cache.put(key, text)
+    return text
+
+async def agenerate_doc(prompt: str, instance_id: str, model_type: str, model: str, system_instruct: str, context_cache: Optional[Tuple[str, str]] = None, use_cache: bool = True) -> Optional[str]:
     """
     Generate a document using the specified model.
     
@@ -49,29 +223,28 @@ def generate_doc(prompt: str, instance_id: str, model_type: str, model: str, sys
         model_type: ["gemini", "deepseek"]
         model: Specific model type
         system_instruct: System instruction for the model
+        context_cache: Optional (cache_name, prefix) from utils.context_cache;
+            Gemini only, used when prompt starts with prefix
+        use_cache: Reuse/store the response in the on-disk response cache
         
     Returns:
         Generated patch string or None if failed
     """
     try:
-        # Call each model
-        if model_type == "gemini":
-            doc_text = generate_gemini(prompt, instance_id, model, system_instruct)
-        
-        if model_type == "deepseek":
-            doc_text = generate_deepseek(prompt, instance_id, model, system_instruct)
+        # Call the model (rate limited, with retry on 429/503)
+        doc_text = await _call_model(prompt, instance_id, model_type, model, system_instruct, context_cache, use_cache)
         
         if not doc_text:
-            print(f"  [WARN] Empty response for {instance_id}")
+            logger.warning(f"[WARN] Empty response for {instance_id}")
             return None
         
         return doc_text
         
     except Exception as e:
-        print(f"  [ERROR] API failed for {instance_id}: {e}")
+        logger.error(f"[ERROR] API failed for {instance_id}: {e}")
         return None
 
-def generate_patch(prompt: str, instance_id: str, model_type: str, model: str, system_instruct: str) -> Optional[str]:
+async def agenerate_patch(prompt: str, instance_id: str, model_type: str, model: str, system_instruct: str, context_cache: Optional[Tuple[str, str]] = None, use_cache: bool = True) -> Optional[str]:
     """
     Generate a patch using specified model.
     
@@ -81,47 +254,134 @@ def generate_patch(prompt: str, instance_id: str, model_type: str, model: str, s
         model_type: ["gemini", "deepseek"]
         model: Specific model type
         system_instruct: System instruction for the model
+        context_cache: Optional (cache_name, prefix) from utils.context_cache;
+            Gemini only, used when prompt starts with prefix
+        use_cache: Reuse/store the response in the on-disk response cache
         
     Returns:
         Generated patch string or None if failed
     """
     try:
-        # Call each model
-        if model_type == "gemini":
-            patch_text = generate_gemini(prompt, instance_id, model, system_instruct)
-        
-        if model_type == "deepseek":
-            patch_text = generate_deepseek(prompt, instance_id, model, system_instruct)
+        # Call the model (rate limited, with retry on 429/503)
+        # Streamed, so a response that does not start like a patch is cut off early
+        patch_text = await _call_model(prompt, instance_id, model_type, model, system_instruct, context_cache, use_cache, PATCH_PREFIXES)
         
         if not patch_text:
-            print(f"  [WARN] Empty response for {instance_id}")
+            logger.warning(f"[WARN] Empty response for {instance_id}")
             return None
         
         # Basic validation that it looks like a patch
         if "diff --git" not in patch_text:
-            print(f"  [WARN] Response doesn't look like a git diff for {instance_id}")
+            logger.warning(f"[WARN] Response doesn't look like a git diff for {instance_id}")
             # Try to extract patch if it's wrapped in code blocks
-            if "```" in patch_text:
-                lines = patch_text.split("\n")
-                in_code_block = False
-                extracted_lines = []
-                for line in lines:
-                    if line.strip().startswith("```"):
-                        in_code_block = not in_code_block
-                        continue
-                    if in_code_block:
-                        extracted_lines.append(line)
-                if extracted_lines and "diff --git" in "\n".join(extracted_lines):
-                    patch_text = "\n".join(extracted_lines)
-                    print(f"  [INFO] Extracted patch from code block")
+            blocks = _FENCE_RE.findall(patch_text)
+            if blocks:
+                candidate = "".join(blocks)
+                if "diff --git" in candidate:
+                    patch_text = candidate
+                    logger.info(f"[INFO] Extracted patch from code block")
         
         return patch_text
         
     except Exception as e:
-        print(f"  [ERROR] API failed for {instance_id}: {e}")
+        logger.error(f"[ERROR] API failed for {instance_id}: {e}")
         return None
 
 
+async def _run_batch(generate: Callable[..., Awaitable[Optional[str]]], tasks: Iterable[Tuple[str, str]], model_type: str, model: str, system_instruct: str, concurrency: int, use_cache: bool) -> List[Optional[str]]:
+    """Run generate over (instance_id, prompt) pairs with at most concurrency calls in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(instance_id: str, prompt: str) -> Optional[str]:
+        async with semaphore:
+            return await generate(prompt, instance_id, model_type, model, system_instruct, use_cache=use_cache)
+
+    return await asyncio.gather(*[bounded(instance_id, prompt) for instance_id, prompt in tasks])
+
+async def generate_patch_batch(tasks: Iterable[Tuple[str, str]], model_type: str, model: str, system_instruct: str, concurrency: int = 8, use_cache: bool = True) -> List[Optional[str]]:
+    """
+    Generate patches for many prompts concurrently.
+    
+    Args:
+        tasks: (instance_id, prompt) pairs
+        model_type: ["gemini", "deepseek"]
+        model: Specific model type
+        system_instruct: System instruction for the model
+        concurrency: Maximum number of requests in flight (the RPM limiter still applies)
+        use_cache: Reuse/store responses in the on-disk response cache
+        
+    Returns:
+        Patch strings (None where generation failed), in the order of tasks
+    """
+    return await _run_batch(agenerate_patch, tasks, model_type, model, system_instruct, concurrency, use_cache)
+
+async def generate_doc_batch(tasks: Iterable[Tuple[str, str]], model_type: str, model: str, system_instruct: str, concurrency: int = 8, use_cache: bool = True) -> List[Optional[str]]:
+    """
+    Generate documents for many prompts concurrently.
+    
+    Same arguments as generate_patch_batch.
+    
+    Returns:
+        Document strings (None where generation failed), in the order of tasks
+    """
+    return await _run_batch(agenerate_doc, tasks, model_type, model, system_instruct, concurrency, use_cache)
+
+async def _close_clients() -> None:
+    """Close the shared clients, whose pooled connections are bound to the current event loop."""
+    # currsize > 0 means the factory has built (and cached) its client
+    if get_deepseek_client.cache_info().currsize:
+        await get_deepseek_client().close()
+    if get_gemini_client.cache_info().currsize:
+        aclose = getattr(get_gemini_client().aio, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    get_gemini_client.cache_clear()
+    get_deepseek_client.cache_clear()
+
+def _run_sync(coro: Awaitable[Any]) -> Any:
+    """
+    Run coro with asyncio.run for synchronous callers.
+    
+    Every asyncio.run has its own event loop, and the shared clients' pooled
+    connections can't be reused on another loop, so they are closed (and
+    recreated on next use) before the loop goes away.
+    """
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await _close_clients()
+    return asyncio.run(runner())
+
+def generate_patch(prompt: str, instance_id: str, model_type: str, model: str, system_instruct: str, use_cache: bool = True) -> Optional[str]:
+    """Synchronous wrapper around agenerate_patch (not usable from inside a running event loop)."""
+    return _run_sync(agenerate_patch(prompt, instance_id, model_type, model, system_instruct, use_cache=use_cache))
+
+def generate_doc(prompt: str, instance_id: str, model_type: str, model: str, system_instruct: str, use_cache: bool = True) -> Optional[str]:
+    """Synchronous wrapper around agenerate_doc (not usable from inside a running event loop)."""
+    return _run_sync(agenerate_doc(prompt, instance_id, model_type, model, system_instruct, use_cache=use_cache))
+
+
+# Output directories already created by this process (skips repeated mkdir/stat calls)
+_DIR_CACHE = set()
+
+def _ensure_dir(path: Path) -> None:
+    """Create path (and parents) the first time it is seen in this process."""
+    if path not in _DIR_CACHE:
+        path.mkdir(parents=True, exist_ok=True)
+        _DIR_CACHE.add(path)
+
+def _write_file(path: Path, text: str) -> None:
+    """Write text to path (create/truncate) with raw os.open/os.write, no file object."""
+    data = text.encode()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]  # os.write may write less than asked
+    finally:
+        os.close(fd)
+
 def save_patch(patch_text: str, task: Dict[str, Any], OUTPUT_DIR) -> str:
     """
     Save generated patch to disk.
@@ -138,14 +398,12 @@ def save_patch(patch_text: str, task: Dict[str, Any], OUTPUT_DIR) -> str:
     instance_id = task["instance_id"]
     
     output_subdir = OUTPUT_DIR / repo_slug
-    output_subdir.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(output_subdir)
     
     patch_file = output_subdir / f"{instance_id}.patch"
+    _write_file(patch_file, patch_text)
     
-    with open(patch_file, "w") as f:
-        f.write(patch_text)
-    
-    print(f"  [SAVED] Patch saved to {patch_file}")
+    logger.debug(f"[SAVED] Patch saved to {patch_file}")
     return str(patch_file)
 
 def save_doc(doc_text: str, task: Dict[str, Any], output_dir) -> str:
@@ -164,12 +422,10 @@ def save_doc(doc_text: str, task: Dict[str, Any], output_dir) -> str:
     instance_id = task["instance_id"]
     
     output_subdir = output_dir / repo_slug
-    output_subdir.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(output_subdir)
     
     doc_file = output_subdir / f"{instance_id}.txt"
+    _write_file(doc_file, doc_text)
     
-    with open(doc_file, "w") as f:
-        f.write(doc_text)
-    
-    print(f"  [SAVED] document saved to {doc_file}")
+    logger.debug(f"[SAVED] document saved to {doc_file}")
     return str(doc_file)
\ No newline at end of file
@@ -1,14 +1,43 @@
-import json
 import csv
+import mmap
+import os
+import re
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from concurrent.futures import Executor, as_completed
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional
 
-def load_successful_instances(oracle_results_file: Path) -> set:
+import orjson
+
+from utils.prompt_builder import FILE_CHARS, MAX_FILES, MAX_READMES, README_CHARS
+
+def iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the records of a JSONL file, parsed with orjson from an mmap of the file.
+    
+    Lines are sliced straight out of the mapping, so the file is never read
+    into one big string or list of lines. Blank lines and a partial last
+    line (left by a crashed run) are skipped.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                if not line.strip():
+                    continue
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+
+
+def load_successful_instances(oracle_results_file: Path) -> Optional[FrozenSet[tuple]]:
     """
     Load instances that passed the fix_patch test from oracle_results.jsonl.
     
     Returns:
-        Set of (repo, base_commit) tuples that passed
+        Frozenset of (repo, base_commit) tuples that passed, or None if the
+        results file does not exist
     """
     successful = set()
     
@@ -17,26 +46,103 @@ def load_successful_instances(oracle_results_file: Path) -> set:
         print("[WARN] Will process all instances")
         return None
     
-    with open(oracle_results_file) as f:
-        for line in f:
-            if line.strip():
-                result = json.loads(line)
-                if result.get("fix_patch") == "PASS":
-                    repo = result.get("repo")
-                    base_commit = result.get("base_commit")
-                    if repo and base_commit:
-                        successful.add((repo, base_commit))
+    for result in iter_jsonl(oracle_results_file):
+        if result.get("fix_patch") == "PASS":
+            repo = result.get("repo")
+            base_commit = result.get("base_commit")
+            if repo and base_commit:
+                successful.add((repo, base_commit))
     
     print(f"[INFO] Loaded {len(successful)} successful instances from oracle_results.jsonl")
-    return successful
+    return frozenset(successful)
 
 
-def load_oracle_tasks(ORACLE_ROOT, successful_filter: set = None,) -> List[Dict[str, Any]]:
+def load_completed_instances(results_file: Path, success_key: str) -> FrozenSet[str]:
+    """
+    Load instance IDs that a previous run already completed successfully.
+    
+    Args:
+        results_file: JSONL results file written by a driver
+        success_key: Result field marking success ("patch_generated" or "doc_generated")
+    
+    Returns:
+        Frozenset of instance IDs whose result has success_key set
+    """
+    done = set()
+    if not results_file.exists():
+        return frozenset()
+    
+    for result in iter_jsonl(results_file):
+        if result.get(success_key) and result.get("instance_id"):
+            done.add(result["instance_id"])
+    
+    return frozenset(done)
+
+
+# Matches "base_commit": "<sha>" keys in raw oracle JSON (escaped copies inside strings don't match)
+_BASE_COMMIT_RE = re.compile(rb'"base_commit"\s*:\s*"([0-9a-fA-F]+)"')
+
+# Returned by _read_oracle_file for files rejected by the base_commit probe
+FILTERED = object()
+
+
+def _read_oracle_file(oracle_file: Path, base_commits: Optional[FrozenSet[str]] = None):
+    """
+    Read one oracle_lite.json and return its features.
+    
+    When base_commits is given, the raw bytes are probed for the base_commit
+    first and files that cannot pass the filter are skipped without a full
+    JSON parse.
+    
+    Returns:
+        Features dict, FILTERED if skipped by the probe, or None if unreadable
+    """
+    try:
+        raw = oracle_file.read_bytes()
+        if base_commits is not None:
+            found = _BASE_COMMIT_RE.findall(raw)
+            if found and not any(c.decode() in base_commits for c in found):
+                return FILTERED
+        data = orjson.loads(raw)
+        return data.get("features", {})
+    except Exception as e:
+        print(f"[ERROR] Failed to load {oracle_file}: {e}")
+        return None
+
+
+def _trim_contents(entries: List[Dict[str, Any]], max_entries: int, max_chars: int) -> List[Dict[str, Any]]:
+    """
+    Keep only the entries and content the prompt builder will use.
+    
+    One extra character is kept past max_chars so the prompt still shows the
+    truncation marker for content that was cut.
+    
+    Args:
+        entries: List of {"file", "content"} dicts from oracle_lite
+        max_entries: Number of leading entries to keep
+        max_chars: Content length used by the prompt builder
+    
+    Returns:
+        Trimmed list; entries that needed no trimming are reused as-is
+    """
+    trimmed = []
+    for entry in entries[:max_entries]:
+        content = entry.get("content")
+        if isinstance(content, str) and len(content) > max_chars + 1:
+            entry = {**entry, "content": content[:max_chars + 1]}
+        trimmed.append(entry)
+    return trimmed
+
+
+def load_oracle_tasks(ORACLE_ROOT, successful_filter: Optional[FrozenSet[tuple]] = None, executor: Optional[Executor] = None) -> List[Dict[str, Any]]:
     """
     Load tasks from Oracle Lite dataset.
     
     Args:
-        successful_filter: Optional set of (repo, base_commit) tuples to filter by
+        successful_filter: Optional frozenset of (repo, base_commit) tuples to filter by;
+            files whose base_commit is not in it are skipped before parsing
+        executor: Optional executor used to read the per-instance JSON files
+            concurrently (I/O bound on the shared filesystem); read serially if None
     
     Returns:
         List of task dictionaries containing oracle_lite data
@@ -50,61 +156,84 @@ def load_oracle_tasks(ORACLE_ROOT, successful_filter: set = None,) -> List[Dict[
         print(f"[ERROR] index.csv not found at {index_csv}")
         return tasks
     
-    with open(index_csv) as f:
-        reader = csv.DictReader(f)
+    # Collect candidate files first, then read them (possibly in parallel)
+    oracle_files = []
+    with open(index_csv, newline="") as f:
+        # Plain reader + column index: only repo_folder is needed, no dict per row
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if "repo_folder" not in header:
+            print(f"[ERROR] index.csv has no repo_folder column: {index_csv}")
+            return tasks
+        folder_idx = header.index("repo_folder")
         for row in reader:
-            repo_folder = ORACLE_ROOT / row['repo_folder']
+            if len(row) <= folder_idx:
+                continue  # blank line (DictReader skipped these too)
+            repo_folder = ORACLE_ROOT / row[folder_idx]
             instances_dir = repo_folder / "instances"
             
             if not instances_dir.exists():
                 print(f"[WARN] Instances directory not found: {instances_dir}")
                 continue
             
-            for inst_dir in instances_dir.iterdir():
-                if inst_dir.is_dir():
-                    oracle_file = inst_dir / "oracle_lite.json"
-                    if oracle_file.exists():
-                        try:
-                            with open(oracle_file) as jf:
-                                data = json.load(jf)
-                                features = data.get("features", {})
-                                
-                                instance_id = features.get("instance_id")
-                                repo = features.get("repo")
-                                base_commit = features.get("base_commit")
-                                
-                                if not repo or not base_commit or not instance_id:
-                                    print(f"[WARN] Missing required fields in {oracle_file}")
-                                    continue
-                                
-                                # Filter by successful instances if filter is provided
-                                if successful_filter is not None:
-                                    if (repo, base_commit) not in successful_filter:
-                                        filtered_count += 1
-                                        continue  # Skip this instance
-                                
-                                # Extract all relevant context
-                                task = {
-                                    "instance_id": instance_id,
-                                    "repo": repo,
-                                    "base_commit": base_commit,
-                                    # Problem descriptions (natural language only)
-                                    "pull_request_text": features.get("pull_request_text", ""),
-                                    "issue_text": features.get("issue_text", ""),
-                                    "natural_brief": features.get("natural-brief", ""),
-                                    "natural_detailed": features.get("natural-detailed", ""),
-                                    # Repository context (non-patch data)
-                                    "readmes": features.get("readmes", []),
-                                    "files": features.get("files", []),
-                                    "new_components": features.get("new_components", []),
-                                    # EXCLUDED: "patch", "test_patch", "non_py_patch", "patch-detailed", "patch-brief"
-                                }
-                                
-                                tasks.append(task)
-                                
-                        except Exception as e:
-                            print(f"[ERROR] Failed to load {oracle_file}: {e}")
-                            continue
+            # scandir's DirEntry.is_dir() reuses the readdir record (no extra stat per entry)
+            with os.scandir(instances_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        oracle_file = Path(entry.path) / "oracle_lite.json"
+                        if oracle_file.exists():
+                            oracle_files.append(oracle_file)
+    
+    base_commits = None
+    if successful_filter is not None:
+        base_commits = frozenset(base_commit for _, base_commit in successful_filter)
+    
+    if executor is None:
+        loaded = ((path, _read_oracle_file(path, base_commits)) for path in oracle_files)
+    else:
+        futures = {executor.submit(_read_oracle_file, path, base_commits): path for path in oracle_files}
+        loaded = ((futures[fut], fut.result()) for fut in as_completed(futures))
+    
+    for oracle_file, features in loaded:
+        if features is FILTERED:
+            filtered_count += 1
+            continue
+        if features is None:
+            continue
+        
+        instance_id = features.get("instance_id")
+        repo = features.get("repo")
+        base_commit = features.get("base_commit")
+        
+        if not repo or not base_commit or not instance_id:
+            print(f"[WARN] Missing required fields in {oracle_file}")
+            continue
+        
+        # Filter by successful instances if filter is provided
+        if successful_filter is not None:
+            if (repo, base_commit) not in successful_filter:
+                filtered_count += 1
+                continue  # Skip this instance
+        
+        # Extract all relevant context
+        task = {
+            "instance_id": instance_id,
+            "repo": repo,
+            "base_commit": base_commit,
+            # Problem descriptions (natural language only)
+            "pull_request_text": features.get("pull_request_text", ""),
+            "issue_text": features.get("issue_text", ""),
+            "natural_brief": features.get("natural-brief", ""),
+            "natural_detailed": features.get("natural-detailed", ""),
+            # Repository context (non-patch data)
+            # Trimmed to what the prompt uses, so the full texts are freed with the parsed JSON
+            "readmes": _trim_contents(features.get("readmes") or [], MAX_READMES, README_CHARS),
+            "files": _trim_contents(features.get("files") or [], MAX_FILES, FILE_CHARS),
+            "new_components": features.get("new_components", []),
+            # EXCLUDED: "patch", "test_patch", "non_py_patch", "patch-detailed", "patch-brief"
+        }
+        
+        tasks.append(task)
     
     if successful_filter is not None:
         print(f"Filtered out {filtered_count} instances that didn't pass fix_patch test.")
@@ -1,107 +1,344 @@
-import argparse
-import json
-from pathlib import Path
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, TextIO, Tuple
 
-def build_prompt(task: dict, role: str) -> str:
+# Fully annotated so the module can be compiled as-is with mypyc
+# (`mypyc utils/prompt_builder.py`); it runs unchanged as plain Python too
+
+# How much repository context goes into a prompt; load_oracle_tasks trims
+# task data to these limits so oversized content is never kept around
+MAX_READMES: int = 2
+README_CHARS: int = 3000
+MAX_FILES: int = 3
+FILE_CHARS: int = 2000
+
+# build_prompts_parallel: tasks per IPC round trip, and the batch size below
+# which process startup costs more than it saves (built serially instead)
+PARALLEL_CHUNKSIZE: int = 64
+PARALLEL_MIN_TASKS: int = 512
+
+# Closing instructions of the "# Task" section; fixed per role, so they are
+# assembled once at import time (adjacent literals are joined by the compiler)
+_BASELINE_INSTRUCTIONS: str = (
+    "Generate a complete git diff format patch to implement the feature described above.\n"
+    "CRITICAL OUTPUT FORMAT REQUIREMENTS:\n\n"
+    "1. Output ONLY the raw patch content - NO markdown code blocks\n\n"
+    "2. Do NOT wrap output in ``` or ```\n"
+    "3. Start your response IMMEDIATELY with patch content\n"
+    "4. Do NOT include 'index <hash>..<hash>' lines\n"
+    "5. First line should be 'diff --git' or '---' (not triple backticks)\n"
+    "EXAMPLE OF CORRECT FORMAT:\n"
+    "diff --git a/file.py b/file.py\n"
+    "--- a/file.py\n"
+    "+++ b/file.py\n"
+    "@@ -1,3 +1,4 @@\n"
+    " existing line\n"
+    "+new line\n"
+    "\n"
+    "WRONG - Do NOT do this:\n"
+    "\n"
+    "diff --git a/file.py b/file.py\n"
+    "```\n"
+    "The patch must be ready to apply with `git apply` without any preprocessing.\n"
+)
+_DOCUMENTER_INSTRUCTIONS: str = "Generate a clear, instructional document explaining how to generate the feature described above.\n"
+_ROLE_SUFFIX: Dict[str, str] = {
+    "baseline": _BASELINE_INSTRUCTIONS,
+    "documenter": _DOCUMENTER_INSTRUCTIONS,
+}
+# Fields that contribute content to a prompt; a task with none of them always
+# renders to the bare section headers, prebuilt here per role
+_CONTENT_FIELDS: Tuple[str, ...] = ("pull_request_text", "issue_text", "readmes", "new_components", "files")
+_EMPTY_TASK_PROMPT: Dict[str, str] = {
+    role: "# Problem Description\n\n\n# Repository Information\n\n\n# Task\n" + suffix
+    for role, suffix in _ROLE_SUFFIX.items()
+}
+
+# Per-section templates: each section is formatted into one string and written
+# with a single call (%-formatting skips the f-string formatter machinery)
+_PR_FMT: str = "## Pull Request\n%s\n\n"
+_ISSUE_FMT: str = "## Issue\n%s\n\n"
+_COMPONENT_FILE_FMT: str = "### File: %s\n"
+_COMPONENT_FMT: str = "**%s**: `%s`\n"
+_SIGNATURE_FMT: str = "```python\n%s\n```\n"
+_DOC_FMT: str = "Description: %s\n"
+_CODE_BLOCK_FMT: str = "### %s\n```\n%s\n```\n\n"
+_TRUNCATED_CODE_BLOCK_FMT: str = "### %s\n```\n%s\n... (truncated)\n```\n\n"
+
+# Display names for the usual new_components types; anything else falls back to capitalize()
+_CAP: Dict[str, str] = {
+    "function": "Function",
+    "class": "Class",
+    "method": "Method",
+    "variable": "Variable",
+}
+
+# Rendered repo documentation keyed by (repo, base_commit); tasks are sorted by repo,
+# so a handful of entries is enough for every instance of a repo to hit
+_REPO_CONTEXT_CACHE: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_REPO_CONTEXT_CACHE_SIZE: int = 8
+
+# UTF-8 encodings of rendered repo documentation, keyed by the rendered text
+# (the same cached str object per repo, so its hash is computed only once)
+_REPO_CONTEXT_BYTES_CACHE: "OrderedDict[str, bytes]" = OrderedDict()
+
+# Built prompts keyed by (repo, instance_id, role); prompts are pure functions of
+# the task, so retries and repeated dumps of the same instance reuse them
+_PROMPT_CACHE: "OrderedDict[Tuple[str, str, str], Tuple[str, str]]" = OrderedDict()
+_PROMPT_CACHE_SIZE: int = 512
+
+def build_repo_context(task: Dict[str, Any]) -> str:
+    """
+    Build the repository documentation section of a prompt.
+    
+    This is the part of the prompt shared by every instance of a repo, so it
+    comes first and can be served from a context/prefix cache. READMEs are
+    fixed for a given commit, so the section is rendered once per
+    (repo, base_commit).
+    
+    Args:
+        task: Task dictionary with oracle_lite data
+        
+    Returns:
+        Formatted documentation section, or "" if the task has no READMEs
+    """
+    repo, base_commit = task.get("repo"), task.get("base_commit")
+    if not repo or not base_commit:
+        return _render_repo_context(task.get("readmes"))
+    
+    key = (repo, base_commit)
+    context = _REPO_CONTEXT_CACHE.get(key)
+    if context is None:
+        context = _render_repo_context(task.get("readmes"))
+        _REPO_CONTEXT_CACHE[key] = context
+        if len(_REPO_CONTEXT_CACHE) > _REPO_CONTEXT_CACHE_SIZE:
+            _REPO_CONTEXT_CACHE.popitem(last=False)
+    else:
+        _REPO_CONTEXT_CACHE.move_to_end(key)
+    return context
+
+def _render_repo_context(readmes: Optional[List[Dict[str, Any]]]) -> str:
+    if not readmes:
+        return ""
+    
+    buf: io.StringIO = io.StringIO()
+    
+    # Add README content (limited to first 2 for brevity)
+    buf.write("# Repository Documentation\n\n")
+    for readme in islice(readmes, MAX_READMES):
+        get = readme.get
+        file_path = get("file", "README")
+        content = get("content", "")
+        # Limit content length
+        if len(content) > README_CHARS:
+            buf.write(_TRUNCATED_CODE_BLOCK_FMT % (file_path, content[:README_CHARS]))
+        else:
+            buf.write(_CODE_BLOCK_FMT % (file_path, content))
+    
+    return buf.getvalue()
+
+def build_prompt(task: Dict[str, Any], role: str, out: Optional[TextIO] = None) -> Optional[str]:
     """
     Build a prompt from task data.
     
     Args:
         task: Task dictionary with oracle_lite data
+        role: ["baseline", "documenter"]
+        out: Optional text stream (file, socket wrapper, ...); when given,
+            the prompt is written to it instead of being joined into a string
         
     Returns:
-        Formatted prompt string
+        Formatted prompt string, or None if it was written to out
+    """
+    prefix, suffix = build_prompt_parts(task, role)
+    if out is None:
+        return prefix + suffix
+    out.write(prefix)
+    out.write(suffix)
+    return None
+
+def build_prompt_bytes(task: Dict[str, Any], role: str) -> bytes:
     """
+    Build a prompt as UTF-8 bytes, for callers that send it over the wire.
+    
+    The repository documentation prefix is shared by every instance of a
+    repo, so its encoding is cached and only the task section is encoded
+    per call.
+    
+    Args:
+        task: Task dictionary with oracle_lite data
+        role: ["baseline", "documenter"]
+        
+    Returns:
+        UTF-8 encoded prompt, equal to build_prompt(task, role).encode("utf-8")
+    """
+    prefix, suffix = build_prompt_parts(task, role)
+    if not prefix:
+        return suffix.encode("utf-8")
+    
+    encoded = _REPO_CONTEXT_BYTES_CACHE.get(prefix)
+    if encoded is None:
+        encoded = prefix.encode("utf-8")
+        _REPO_CONTEXT_BYTES_CACHE[prefix] = encoded
+        if len(_REPO_CONTEXT_BYTES_CACHE) > _REPO_CONTEXT_CACHE_SIZE:
+            _REPO_CONTEXT_BYTES_CACHE.popitem(last=False)
+    else:
+        _REPO_CONTEXT_BYTES_CACHE.move_to_end(prefix)
+    return encoded + suffix.encode("utf-8")
+
+def build_prompt_parts(task: Dict[str, Any], role: str) -> Tuple[str, str]:
+    """
+    Build a prompt from task data, split into a cacheable prefix and the rest.
+    
+    Args:
+        task: Task dictionary with oracle_lite data
+        role: ["baseline", "documenter"]
+        
+    Returns:
+        (cacheable_prefix, suffix) where cacheable_prefix is the repository
+        documentation and suffix is the task-specific remainder
+    """
+    if role in _EMPTY_TASK_PROMPT and not any(task.get(k) for k in _CONTENT_FIELDS):
+        return "", _EMPTY_TASK_PROMPT[role]
+    
+    instance_id = task.get("instance_id")
+    if not instance_id:
+        return _render_prompt_parts(task, role)
+    
+    key = (task.get("repo") or "", instance_id, role)
+    parts = _PROMPT_CACHE.get(key)
+    if parts is None:
+        parts = _render_prompt_parts(task, role)
+        _PROMPT_CACHE[key] = parts
+        if len(_PROMPT_CACHE) > _PROMPT_CACHE_SIZE:
+            _PROMPT_CACHE.popitem(last=False)
+    else:
+        _PROMPT_CACHE.move_to_end(key)
+    return parts
+
+def build_prompts_batch(tasks: List[Dict[str, Any]], role: str) -> List[Tuple[str, str]]:
+    """
+    Build prompts for a batch of tasks.
+    
+    Tasks are rendered grouped by (repo, base_commit), so every repo's
+    documentation section is built once and then served from the context
+    cache even when the batch is not sorted by repo.
+    
+    Args:
+        tasks: Task dictionaries with oracle_lite data
+        role: ["baseline", "documenter"]
+        
+    Returns:
+        (cacheable_prefix, suffix) pairs, in the same order as tasks
+    """
+    results: List[Tuple[str, str]] = [("", "")] * len(tasks)
+    for i in _repo_order(tasks):
+        results[i] = build_prompt_parts(tasks[i], role)
+    return results
+
+def build_prompts_parallel(tasks: List[Dict[str, Any]], role: str, workers: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    Build prompts for a large batch of tasks across worker processes.
+    
+    Prompt building is pure CPU-bound string work, so it scales with cores.
+    Tasks are handed out in (repo, base_commit) order in chunks of
+    PARALLEL_CHUNKSIZE, which keeps a repo's instances on the same worker
+    and its documentation cache warm. Small batches (or workers <= 1) are
+    built in-process with build_prompts_batch.
+    
+    Args:
+        tasks: Task dictionaries with oracle_lite data
+        role: ["baseline", "documenter"]
+        workers: Number of worker processes (default: os.cpu_count())
+        
+    Returns:
+        (cacheable_prefix, suffix) pairs, in the same order as tasks
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(tasks) < PARALLEL_MIN_TASKS:
+        return build_prompts_batch(tasks, role)
+    
+    order = _repo_order(tasks)
+    results: List[Tuple[str, str]] = [("", "")] * len(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        built = pool.map(partial(build_prompt_parts, role=role), [tasks[i] for i in order], chunksize=PARALLEL_CHUNKSIZE)
+        for i, parts in zip(order, built):
+            results[i] = parts
+    return results
+
+def _repo_order(tasks: List[Dict[str, Any]]) -> List[int]:
+    # Indices of tasks sorted by (repo, base_commit); sorting is stable, so
+    # instances of a repo keep their relative order
+    return sorted(range(len(tasks)), key=lambda i: (tasks[i].get("repo") or "", tasks[i].get("base_commit") or ""))
+
+def _render_prompt_parts(task: Dict[str, Any], role: str) -> Tuple[str, str]:
     feat = task
-    prompt_parts = []
+    # Fragments are written into one growing buffer instead of being kept
+    # alive as separate strings until a final join
+    buf: io.StringIO = io.StringIO()
     
     # Add problem description from oracle data
-    prompt_parts.append("# Problem Description\n\n")
+    buf.write("# Problem Description\n\n")
     
     pull_request_text = feat.get("pull_request_text")
     if pull_request_text:
-        prompt_parts.append(f"## Pull Request\n{pull_request_text}\n\n")
+        buf.write(_PR_FMT % (pull_request_text,))
     
     issue_text = feat.get("issue_text")
     if issue_text:
-        prompt_parts.append(f"## Issue\n{issue_text}\n\n")
+        buf.write(_ISSUE_FMT % (issue_text,))
     
     # if task["natural_detailed"]:
-    #     prompt_parts.append(f"## Feature Description\n{task['natural_detailed']}\n\n")
+    #     buf.write(f"## Feature Description\n{task['natural_detailed']}\n\n")
     # elif task["natural_brief"]:
-    #     prompt_parts.append(f"## Feature Description\n{task['natural_brief']}\n\n")
+    #     buf.write(f"## Feature Description\n{task['natural_brief']}\n\n")
     
     # Add oracle JSON metadata
-    prompt_parts.append("\n# Repository Information\n\n")
-    
-    # Add README content (limited to first 2 for brevity)
-    readmes = feat.get("readmes") 
-    if readmes:
-        prompt_parts.append("## Repository Documentation\n")
-        for readme in readmes[:2]:
-            file_path = readme.get("file", "README")
-            content = readme.get("content", "")
-            # Limit content length
-            if len(content) > 3000:
-                content = content[:3000] + "\n... (truncated)"
-            prompt_parts.append(f"### {file_path}\n```\n{content}\n```\n\n")
+    buf.write("\n# Repository Information\n\n")
     
     # Add new component signatures
     new_components = feat.get("new_components")
     if new_components:
-        prompt_parts.append("## New Components to Implement\n")
+        buf.write("## New Components to Implement\n")
         for comp in new_components:
-            file_path = comp.get("file", "unknown")
-            prompt_parts.append(f"### File: {file_path}\n")
-            for component in comp.get("components", []):
-                comp_type = component.get("type", "function")
-                signature = component.get("signature", "")
-                doc = component.get("doc", "")
-                name = component.get("name", "")
+            # Bound .get once per dict instead of an attribute lookup per field
+            comp_get = comp.get
+            file_path = comp_get("file", "unknown")
+            buf.write(_COMPONENT_FILE_FMT % (file_path,))
+            for component in comp_get("components", ()):
+                get = component.get
+                comp_type = get("type", "function")
+                signature = get("signature", "")
+                doc = get("doc", "")
+                name = get("name", "")
                 
-                prompt_parts.append(f"**{comp_type.capitalize()}**: `{name}`\n")
+                buf.write(_COMPONENT_FMT % (_CAP.get(comp_type) or comp_type.capitalize(), name))
                 if signature:
-                    prompt_parts.append(f"```python\n{signature}\n```\n")
+                    buf.write(_SIGNATURE_FMT % (signature,))
                 if doc:
-                    prompt_parts.append(f"Description: {doc}\n")
-                prompt_parts.append("\n")
+                    buf.write(_DOC_FMT % (doc,))
+                buf.write("\n")
     
     # Add relevant file snippets (limited)
-    files = feat.get("files") 
+    files = feat.get("files")
     if files:
-        prompt_parts.append("## Relevant Code Files\n")
-        for file_info in files[:3]:  # Limit to first 3 files
-            file_path = file_info.get("file", "unknown")
-            content = file_info.get("content", "")
+        buf.write("## Relevant Code Files\n")
+        for file_info in islice(files, MAX_FILES):  # Limit to first few files
+            get = file_info.get
+            file_path = get("file", "unknown")
+            content = get("content", "")
             # Limit content length
-            if len(content) > 2000:
-                content = content[:2000] + "\n... (truncated)"
-            prompt_parts.append(f"### {file_path}\n```\n{content}\n```\n\n")
+            if len(content) > FILE_CHARS:
+                buf.write(_TRUNCATED_CODE_BLOCK_FMT % (file_path, content[:FILE_CHARS]))
+            else:
+                buf.write(_CODE_BLOCK_FMT % (file_path, content))
     
     # Final instruction
-    prompt_parts.append("\n# Task\n")
-    if role == "baseline":
-        prompt_parts.append("Generate a complete git diff format patch to implement the feature described above.\n")
-        prompt_parts.append("CRITICAL OUTPUT FORMAT REQUIREMENTS:\n\n")
-        prompt_parts.append("1. Output ONLY the raw patch content - NO markdown code blocks\n\n")
-        prompt_parts.append("2. Do NOT wrap output in ``` or ```\n")
-        prompt_parts.append("3. Start your response IMMEDIATELY with patch content\n")
-        prompt_parts.append("4. Do NOT include 'index <hash>..<hash>' lines\n")
-        prompt_parts.append("5. First line should be 'diff --git' or '---' (not triple backticks)\n")
-        prompt_parts.append("EXAMPLE OF CORRECT FORMAT:\n")
-        prompt_parts.append("diff --git a/file.py b/file.py\n")
-        prompt_parts.append("--- a/file.py\n")
-        prompt_parts.append("+++ b/file.py\n")
-        prompt_parts.append("@@ -1,3 +1,4 @@\n")
-        prompt_parts.append(" existing line\n")
-        prompt_parts.append("+new line\n")
-        prompt_parts.append("\n")
-        prompt_parts.append("WRONG - Do NOT do this:\n")
-        prompt_parts.append("\n")
-        prompt_parts.append("diff --git a/file.py b/file.py\n")
-        prompt_parts.append("```\n")
-        prompt_parts.append("The patch must be ready to apply with `git apply` without any preprocessing.\n")
-    if role == "documenter":
-        prompt_parts.append("Generate a clear, instructional document explaining how to generate the feature described above.\n")
-    
-    return "".join(prompt_parts)
\ No newline at end of file
+    buf.write("\n# Task\n")
+    buf.write(_ROLE_SUFFIX.get(role, ""))
+    
+    return build_repo_context(task), buf.getvalue()
\ No newline at end of file
@@ -0,0 +1,41 @@
+import hashlib
+from typing import Optional
+
+from diskcache import Cache
+
+# Shared on-disk cache of model responses, so re-runs do not pay for prompts already answered
+CACHE_DIR = "/storage/ice1/shared/ece8803cai/team14/.llm_cache"
+
+_cache = None
+
+
+def _get_cache() -> Cache:
+    global _cache
+    if _cache is None:
+        _cache = Cache(CACHE_DIR)
+    return _cache
+
+
+def make_key(model: str, system_instruct: str, prompt: str) -> str:
+    """
+    Build the content-addressed cache key for one model call.
+
+    Args:
+        model: Specific model name
+        system_instruct: System instruction sent with the prompt
+        prompt: The full prompt
+
+    Returns:
+        Hex SHA-256 digest of model, system instruction and prompt
+    """
+    return hashlib.sha256(f"{model}\0{system_instruct}\0{prompt}".encode()).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    """Return the cached response for key, or None on a miss."""
+    return _get_cache().get(key)
+
+
+def put(key: str, value: str) -> None:
+    """Store a model response under key."""
+    _get_cache().set(key, value)